@@ -55,6 +55,7 @@ setup(
         'treq<16.12.0',
         'confmodel>=0.2.0',
         'hyperloglog',
+        'lupa',
     ],
     classifiers=[
         'Development Status :: 4 - Beta',
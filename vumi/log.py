@@ -16,6 +16,26 @@ msg = info
 err = error
 
 
+class LazyFormat(object):
+    '''Defers an expensive log-message computation until a log observer
+    actually renders the message.
+
+    Twisted's legacy log API formats message arguments eagerly, so things
+    like hex-encoding a PDU for a debug line are paid for even when the
+    debug output is dropped. Wrapping the computation in a LazyFormat
+    moves that cost to the observer that renders the event (if any).
+    '''
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    def __repr__(self):
+        return str(self)
+
+
 class WrappingLogger(object):
     '''A logger that will add the additional arguments that it is initialized
     with to every logging call.'''
@@ -2,11 +2,13 @@
 
 import fnmatch
 from functools import wraps
+import hashlib
 from itertools import takewhile, dropwhile
 import os
 from zlib import crc32
 
 from hyperloglog import HyperLogLog
+from lupa import LuaRuntime, LuaError
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred, execute
 from twisted.internet.task import Clock
@@ -55,6 +57,8 @@ class FakeRedis(object):
         self._charset = charset
         self._charset_errors = errors
         self._delayed_calls = []
+        self._scripts = {}
+        self._lua_runtime = None
 
     def teardown(self):
         self._clean_up_expires()
@@ -441,14 +445,18 @@ class FakeRedis(object):
             return self._data[key].pop(-1)
 
     @maybe_async
-    def lpush(self, key, obj):
-        self._setdefault_key(key, []).insert(0, self._encode(obj))
-        return self.llen.sync(self, key)
+    def lpush(self, key, obj, *objs):
+        lval = self._setdefault_key(key, [])
+        for value in (obj,) + objs:
+            lval.insert(0, self._encode(value))
+        return len(lval)
 
     @maybe_async
-    def rpush(self, key, obj):
-        self._setdefault_key(key, []).append(self._encode(obj))
-        return self.llen.sync(self, key)
+    def rpush(self, key, obj, *objs):
+        lval = self._setdefault_key(key, [])
+        for value in (obj,) + objs:
+            lval.append(self._encode(value))
+        return len(lval)
 
     @maybe_async
     def lrange(self, key, start, end):
@@ -539,6 +547,133 @@ class FakeRedis(object):
         hll = self._data.get(key, HyperLogLog(0.01))
         return len(hll)
 
+    # Scripting operations
+
+    @maybe_async
+    def eval(self, script, keys=(), args=()):
+        # Real Redis adds the script to the script cache on EVAL as well.
+        self._scripts[self._script_sha(script)] = script
+        return self._run_lua_script(script, keys, args)
+
+    @maybe_async
+    def evalsha(self, sha, keys=(), args=()):
+        script = self._scripts.get(sha.lower())
+        if script is None:
+            raise ResponseError(
+                "NOSCRIPT No matching script. Please use EVAL.")
+        return self._run_lua_script(script, keys, args)
+
+    @maybe_async
+    def script_load(self, script):
+        sha = self._script_sha(script)
+        self._scripts[sha] = script
+        return sha
+
+    def _script_sha(self, script):
+        return hashlib.sha1(self._encode(script)).hexdigest()
+
+    # Commands scripts may not call. Real Redis also disallows these, and
+    # allowing them here would let a script recurse into the script engine.
+    _SCRIPT_FORBIDDEN_CALLS = frozenset(['eval', 'evalsha', 'script_load'])
+
+    def _get_lua_runtime(self):
+        if self._lua_runtime is None:
+            self._lua_runtime = LuaRuntime(unpack_returned_tuples=True)
+        return self._lua_runtime
+
+    def _run_lua_script(self, script, keys, args):
+        """
+        Execute a Lua script the way a real Redis server would.
+
+        The script is wrapped in a function so that top-level ``return``
+        statements are legal, and is handed ``KEYS``, ``ARGV`` and a
+        ``redis`` table whose ``call`` entry dispatches back into this
+        fake's own command implementations.
+        """
+        lua = self._get_lua_runtime()
+        try:
+            lua_func = lua.eval(
+                "function(KEYS, ARGV, redis)\n%s\nend" % (script,))
+        except LuaError, e:
+            raise ResponseError("Error compiling script: %s" % (e,))
+        redis_obj = lua.table(
+            call=lambda command, *a: self._lua_redis_call(lua, command, *a))
+        try:
+            result = lua_func(
+                lua.table_from([self._encode(key) for key in keys]),
+                lua.table_from([self._encode(arg) for arg in args]),
+                redis_obj)
+        except LuaError, e:
+            raise ResponseError("Error running script: %s" % (e,))
+        return self._lua_to_redis_result(result)
+
+    def _lua_redis_call(self, lua, command, *args):
+        command = self._encode(command).lower()
+        if command in self._SCRIPT_FORBIDDEN_CALLS:
+            raise ResponseError(
+                "This Redis command is not allowed from scripts: %s" % (
+                    command,))
+        # Some commands don't match our method names: DEL is a reserved
+        # word in Python and the python redis lib folds INCRBY/DECRBY into
+        # incr()/decr().
+        aliases = {'del': 'delete', 'incrby': 'incr', 'decrby': 'decr'}
+        method = getattr(self, aliases.get(command, command), None)
+        sync_func = getattr(method, 'sync', None)
+        if sync_func is None:
+            raise ResponseError(
+                "Unknown Redis command called from script: %s" % (command,))
+        result = sync_func(self, *[self._lua_call_arg(arg) for arg in args])
+        return self._redis_result_to_lua(lua, result)
+
+    def _lua_call_arg(self, arg):
+        # Arguments to redis.call() may only be strings or numbers. Lua
+        # numbers usually arrive as floats, which none of our command
+        # implementations expect, so integral values are turned back into
+        # ints.
+        if isinstance(arg, float) and arg == int(arg):
+            return int(arg)
+        if isinstance(arg, (int, long)):
+            return arg
+        if isinstance(arg, basestring):
+            return self._encode(arg)
+        raise ResponseError(
+            "Lua redis() command arguments must be strings or integers")
+
+    def _redis_result_to_lua(self, lua, value):
+        # A nil reply becomes false, booleans become integers and lists
+        # become Lua tables, matching real Redis' reply conversion.
+        if value is None:
+            return False
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (list, tuple)):
+            return lua.table_from(
+                [self._redis_result_to_lua(lua, v) for v in value])
+        return value
+
+    def _lua_to_redis_result(self, value):
+        # nil and false become None, numbers are truncated to integers and
+        # tables become lists, matching real Redis' result conversion.
+        if value is None or value is False:
+            return None
+        if value is True:
+            return 1
+        if isinstance(value, float):
+            return int(value)
+        if isinstance(value, unicode):
+            return self._encode(value)
+        if isinstance(value, (int, long, str)):
+            return value
+        # Anything else should be a Lua table, which becomes a list. Real
+        # Redis stops at the first nil value.
+        result = []
+        for index in xrange(1, len(value) + 1):
+            item = value[index]
+            if item is None:
+                break
+            result.append(self._lua_to_redis_result(item))
+        return result
+
 
 class Zset(object):
     """A Redis-like ordered set implementation."""
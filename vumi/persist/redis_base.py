@@ -293,8 +293,8 @@ class Manager(object):
     llen = RedisCall(['key'])
     lpop = RedisCall(['key'])
     rpop = RedisCall(['key'])
-    lpush = RedisCall(['key', 'obj'])
-    rpush = RedisCall(['key', 'obj'])
+    lpush = RedisCall(['key', 'obj'], vararg='objs')
+    rpush = RedisCall(['key', 'obj'], vararg='objs')
     lrange = RedisCall(['key', 'start', 'end'])
     lrem = RedisCall(['key', 'value', 'num'], defaults=[0])
     rpoplpush = RedisCall(
@@ -311,3 +311,21 @@ class Manager(object):
 
     pfadd = RedisCall(['key'], vararg='values')
     pfcount = RedisCall(['key'])
+
+    # Scripting operations
+    #
+    # Scripts operate on keys inside this manager's key prefix, so each
+    # entry in ``keys`` is prefixed before the call is handed to the
+    # client. These are plain methods rather than `RedisCall`s because
+    # `RedisCall` only knows how to prefix individual arguments.
+
+    def eval(self, script, keys=(), args=()):
+        keys = [self._key(key) for key in keys]
+        return self._make_redis_call('eval', script, keys, args)
+
+    def evalsha(self, sha, keys=(), args=()):
+        keys = [self._key(key) for key in keys]
+        return self._make_redis_call('evalsha', sha, keys, args)
+
+    def script_load(self, script):
+        return self._make_redis_call('script_load', script)
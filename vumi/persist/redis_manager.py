@@ -22,6 +22,22 @@ class VumiRedis(redis.Redis):
         """
         return super(VumiRedis, self).setex(key, value, seconds)
 
+    def eval(self, script, keys=(), args=()):
+        """
+        The underlying .eval() takes a key count followed by a combined
+        list of keys and arguments. This wrapper accepts separate key and
+        argument sequences so that it matches the txredis implementation.
+        """
+        return super(VumiRedis, self).eval(
+            script, len(keys), *(tuple(keys) + tuple(args)))
+
+    def evalsha(self, sha, keys=(), args=()):
+        """
+        See :meth:`eval`.
+        """
+        return super(VumiRedis, self).evalsha(
+            sha, len(keys), *(tuple(keys) + tuple(args)))
+
     def scan(self, cursor, match=None, count=None):
         """
         Scan through all the keys in the database returning those that
@@ -365,6 +365,20 @@ class FakeRedisTestMixin(object):
         yield self.assert_redis_op(
             redis, ['1', 'a', '7'], 'lrange', 'list', 0, -1)
 
+    @inlineCallbacks
+    def test_lpush_multiple_values(self):
+        redis = yield self.get_redis()
+        yield self.assert_redis_op(redis, 3, 'lpush', 'list', 1, 'a', '7')
+        yield self.assert_redis_op(
+            redis, ['7', 'a', '1'], 'lrange', 'list', 0, -1)
+
+    @inlineCallbacks
+    def test_rpush_multiple_values(self):
+        redis = yield self.get_redis()
+        yield self.assert_redis_op(redis, 3, 'rpush', 'list', 1, 'a', '7')
+        yield self.assert_redis_op(
+            redis, ['1', 'a', '7'], 'lrange', 'list', 0, -1)
+
     @inlineCallbacks
     def test_rpop(self):
         redis = yield self.get_redis()
@@ -549,6 +563,60 @@ class FakeRedisTestMixin(object):
         yield self.assert_redis_op(redis, 0, 'pfadd', 'hll2', 'a', 'b')
         yield self.assert_redis_op(redis, 2, 'pfcount', 'hll2')
 
+    @inlineCallbacks
+    def test_eval(self):
+        redis = yield self.get_redis()
+        yield redis.set("evalkey", "42")
+        yield self.assert_redis_op(
+            redis, 43, 'eval',
+            "return tonumber(redis.call('GET', KEYS[1]))"
+            " + tonumber(ARGV[1])",
+            ["evalkey"], ["1"])
+
+    @inlineCallbacks
+    def test_eval_modifies_data(self):
+        redis = yield self.get_redis()
+        yield redis.set("evalkey", "1")
+        yield self.assert_redis_op(
+            redis, 1, 'eval',
+            "if redis.call('GET', KEYS[1]) == ARGV[1] then"
+            " redis.call('DEL', KEYS[1]) return 1"
+            " end return 0",
+            ["evalkey"], ["1"])
+        yield self.assert_redis_op(redis, False, 'exists', "evalkey")
+
+    @inlineCallbacks
+    def test_eval_nil_results(self):
+        redis = yield self.get_redis()
+        yield self.assert_redis_op(
+            redis, None, 'eval', "return redis.call('GET', KEYS[1])",
+            ["missingkey"])
+        yield self.assert_redis_op(redis, None, 'eval', "return false")
+
+    @inlineCallbacks
+    def test_eval_table_result(self):
+        redis = yield self.get_redis()
+        yield self.assert_redis_op(
+            redis, ["a", 2, "c"], 'eval',
+            "return {KEYS[1], 2, ARGV[1]}", ["a"], ["c"])
+
+    @inlineCallbacks
+    def test_eval_bad_script(self):
+        redis = yield self.get_redis()
+        yield self.assert_redis_error(redis, 'eval', "this is not lua")
+
+    @inlineCallbacks
+    def test_evalsha(self):
+        redis = yield self.get_redis()
+        sha = yield redis.script_load("return tonumber(ARGV[1]) * 2")
+        yield self.assert_redis_op(redis, 6, 'evalsha', sha, [], ["3"])
+
+    @inlineCallbacks
+    def test_evalsha_unknown_script(self):
+        redis = yield self.get_redis()
+        yield self.assert_redis_error(
+            redis, 'evalsha', "0" * 40, [], [])
+
 
 class FakeRedisUnverifiedTestMixin(object):
     """
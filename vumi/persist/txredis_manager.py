@@ -94,6 +94,17 @@ class VumiRedis(txr.Redis):
         self._send('LPOP', key)
         return self.getResponse()
 
+    # txredis' push() only handles a single value, so we issue the
+    # variadic forms (redis server >= 2.4) ourselves.
+
+    def lpush(self, key, *values):
+        self._send('LPUSH', key, *values)
+        return self.getResponse()
+
+    def rpush(self, key, *values):
+        self._send('RPUSH', key, *values)
+        return self.getResponse()
+
     def set(self, key, value, *args, **kw):
         d = super(VumiRedis, self).set(key, value, *args, **kw)
         d.addCallback(self._ok_to_true)
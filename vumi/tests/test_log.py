@@ -10,6 +10,29 @@ class TracerException(Exception):
     pass
 
 
+class TestLazyFormat(VumiTestCase):
+
+    def test_formatting_deferred_until_render(self):
+        calls = []
+
+        def expensive(arg):
+            calls.append(arg)
+            return 'value=%s' % (arg,)
+
+        lazy = log.LazyFormat(expensive, 'foo')
+        self.assertEqual(calls, [])
+        self.assertEqual(str(lazy), 'value=foo')
+        self.assertEqual(repr(lazy), 'value=foo')
+        self.assertEqual(calls, ['foo', 'foo'])
+
+    def test_log_message(self):
+        with LogCatcher() as lc:
+            log.debug('prefix', log.LazyFormat(lambda: 'lazy'))
+        [entry] = lc.logs
+        self.assertEqual(
+            ' '.join(str(part) for part in entry['message']), 'prefix lazy')
+
+
 class TestVumiLog(VumiTestCase):
 
     def test_normal_log_levels(self):
@@ -100,15 +100,18 @@ class LogCatcher(object):
         return [ev for ev in self.logs if ev["isError"]]
 
     def messages(self):
-        return [" ".join(msg['message']) for msg in self.logs
-                if not msg["isError"]]
+        # Message parts aren't necessarily strings (a real log observer
+        # renders them with str()), so we do the same here.
+        return [" ".join(str(part) for part in msg['message'])
+                for msg in self.logs if not msg["isError"]]
 
     def _keep_log(self, event_dict):
         if self.system is not None:
             if not self.system.search(event_dict.get('system', '-')):
                 return False
         if self.message is not None:
-            log_message = " ".join(event_dict.get('message', []))
+            log_message = " ".join(
+                str(part) for part in event_dict.get('message', []))
             if not self.message.search(log_message):
                 return False
         if self.log_level is not None:
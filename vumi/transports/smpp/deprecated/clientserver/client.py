@@ -2,12 +2,11 @@
 
 import json
 import uuid
-from random import randint
+from struct import pack, pack_into, unpack_from
 
 from twisted.internet import reactor
 from twisted.internet.protocol import Protocol, ClientFactory
-from twisted.internet.task import LoopingCall
-from twisted.internet.defer import inlineCallbacks, returnValue, DeferredQueue
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 
 import binascii
 from smpp.pdu import unpack_pdu
@@ -18,10 +17,50 @@ from smpp.pdu_inspector import (
     MultipartMessage, detect_multipart, multipart_key)
 
 from vumi import log
+from vumi.log import LazyFormat
 
 
 GSM_MAX_SMS_BYTES = 140
 
+# Bound-state guards sit on the submit and deliver hot paths, so they're
+# frozensets (hash lookup, no per-call list allocation) rather than
+# literal lists.
+SEND_STATES = frozenset(['BOUND_TX', 'BOUND_TRX'])
+RECV_STATES = frozenset(['BOUND_RX', 'BOUND_TRX'])
+BOUND_STATES = frozenset(['BOUND_TX', 'BOUND_RX', 'BOUND_TRX'])
+
+#: Lua script to atomically claim a block of sequence numbers and reset
+#: the counter once it has passed a given threshold. Returns the top of
+#: the claimed block.
+#:
+#: KEYS: [counter_key]
+#: ARGV: [count, threshold]
+#:
+#: The increment and the wrap check run in one atomic step on the server,
+#: so there is no need for the lock key the old Python implementation
+#: used, and no window in which another client can reset the counter
+#: behind our back.
+GET_SEQ_RANGE_LUA = """
+local seq = redis.call('INCRBY', KEYS[1], tonumber(ARGV[1]))
+if seq >= tonumber(ARGV[2]) then
+    redis.call('DEL', KEYS[1])
+end
+return seq
+"""
+
+# Enquire link PDUs (and their responses) differ only in their sequence
+# number field, so we serialise one of each once and patch the four
+# sequence number bytes per send instead of building and packing a fresh
+# PDU object every interval.
+ENQUIRE_LINK_BIN = EnquireLink(0).get_bin()
+ENQUIRE_LINK_RESP_BIN = EnquireLinkResp(0).get_bin()
+
+
+def patch_sequence_number(template, sequence_number):
+    buf = bytearray(template)
+    pack_into('>I', buf, 12, sequence_number)
+    return str(buf)
+
 
 def unpacked_pdu_opts(unpacked_pdu):
     pdu_opts = {}
@@ -55,103 +94,162 @@ class EsmeTransceiver(Protocol):
         self.bind_params = bind_params
         self.esme_callbacks = esme_callbacks
         self.state = 'CLOSED'
-        log.msg('STATE: %s' % (self.state,))
+        log.msg('STATE:', self.state)
         self.smpp_bind_timeout = self.config.smpp_bind_timeout
         self.smpp_enquire_link_interval = \
                 self.config.smpp_enquire_link_interval
-        self.datastream = ''
+        self.datastream = bytearray()
+        self._read_pos = 0
         self.redis = redis
+        self._redis_script_shas = {}
+        # Locally-held block of sequence numbers: the next number to hand
+        # out and the first number we don't hold.
+        self._seq_next = 0
+        self._seq_top = 0
+        self._multipart_ref = 0
         self._lose_conn = None
-        # The PDU queue ensures that PDUs are processed in the order
-        # they arrive. `self._process_pdu_queue()` loops forever
-        # pulling PDUs off the queue and handling each before grabbing
-        # the next.
-        self._pdu_queue = DeferredQueue()
-        self._process_pdu_queue()  # intentionally throw away deferred
+        self._enquire_link_running = False
+        self._enquire_link_call = None
+        self._enquire_link_d = succeed(None)
+        # PDUs are processed in the order they arrive by chaining each
+        # one off the previous PDU's deferred. This gives the same
+        # ordering guarantee a DeferredQueue with a single consumer
+        # would, without a queue put/get and an extra reactor turn per
+        # PDU.
+        self._process_pdu_d = succeed(None)
+        cls = self.__class__
+        if '_HANDLERS' not in cls.__dict__:
+            # The command_id -> handler method table is built once per
+            # class (Protocol is a classic class, so this can't live in a
+            # metaclass) and shared by every connection, making inbound
+            # dispatch a single dict lookup per PDU instead of a string
+            # format plus an attribute lookup. Subclasses that override
+            # handle_* methods get their own table.
+            cls._HANDLERS = dict(
+                (name[len('handle_'):], getattr(cls, name))
+                for name in dir(cls) if name.startswith('handle_'))
+
+    # How many sequence numbers to claim from redis per allocation.
+    # Bigger blocks mean fewer round-trips but more numbers burned when
+    # the process restarts, which is harmless -- they just go unused.
+    SEQUENCE_NUMBER_BLOCK_SIZE = 1000
 
     @inlineCallbacks
     def get_next_seq(self):
         """Get the next available SMPP sequence number.
 
         The valid range of sequence number is 0x00000001 to 0xFFFFFFFF.
+        We wrap at 0xFFFF0000 to stay well clear of the upper limit.
 
-        We start trying to wrap at 0xFFFF0000 so we can keep returning values
-        (up to 0xFFFF of them) even while someone else is in the middle of
-        resetting the counter.
+        Sequence numbers are claimed from the shared redis counter a
+        block at a time and handed out locally, so redis still arbitrates
+        between processes but only one PDU in every
+        ``SEQUENCE_NUMBER_BLOCK_SIZE`` pays a network round-trip.
         """
-        seq = yield self.redis.incr('smpp_last_sequence_number')
+        if self._seq_next >= self._seq_top:
+            top = yield self._eval_redis_script(
+                GET_SEQ_RANGE_LUA, ['smpp_last_sequence_number'],
+                [self.SEQUENCE_NUMBER_BLOCK_SIZE, 0xFFFF0000])
+            self._seq_next = top - self.SEQUENCE_NUMBER_BLOCK_SIZE + 1
+            self._seq_top = top + 1
+        seq = self._seq_next
+        self._seq_next += 1
+        returnValue(seq)
 
-        if seq >= 0xFFFF0000:
-            # We're close to the upper limit, so try to reset. It doesn't
-            # matter if we actually succeed or not, since we're going to return
-            # `seq` anyway.
-            yield self._reset_seq_counter()
+    @inlineCallbacks
+    def get_next_seq_range(self, n):
+        """Claim a contiguous block of ``n`` SMPP sequence numbers.
 
-        returnValue(seq)
+        Served from the locally-held block where possible, and otherwise
+        claimed in a single round-trip to redis regardless of ``n``,
+        which is what makes multipart sends cheap.
+        """
+        if self._seq_top - self._seq_next >= n:
+            seqs = range(self._seq_next, self._seq_next + n)
+            self._seq_next += n
+            returnValue(seqs)
+        top = yield self._eval_redis_script(
+            GET_SEQ_RANGE_LUA, ['smpp_last_sequence_number'],
+            [n, 0xFFFF0000])
+        returnValue(range(top - n + 1, top + 1))
 
     @inlineCallbacks
-    def _reset_seq_counter(self):
-        """Reset the sequence counter in a safe manner.
-
-        NOTE: There is a potential race condition in this implementation. If we
-        acquire the lock and it expires while we still think we hold it, it's
-        possible for the sequence number to be reset by someone else between
-        the final vlue check and the reset call. This seems like a very
-        unlikely situation, so we'll leave it like that for now.
-
-        A better solution is to replace this whole method with a lua script
-        that we send to redis, but scripting support is still very new at the
-        time of writing.
+    def _eval_redis_script(self, script, keys, args):
+        """Run a Lua script on our redis server.
+
+        The script's SHA1 is cached so that after the first call we only
+        send the digest rather than the script body. If the server's script
+        cache has been flushed we fall back to a plain EVAL, which primes
+        the cache again.
         """
-        # SETNX can be used as a lock.
-        locked = yield self.redis.setnx('smpp_last_sequence_number_wrap', 1)
-
-        # If someone crashed in exactly the wrong place, the lock may be
-        # held by someone else but have no expire time. A race condition
-        # here may set the TTL multiple times, but that's fine.
-        if (yield self.redis.ttl('smpp_last_sequence_number_wrap')) < 0:
-            # The TTL only gets set if the lock exists and recently had no TTL.
-            yield self.redis.expire('smpp_last_sequence_number_wrap', 10)
-
-        if not locked:
-            # We didn't actually get the lock, so our job is done.
-            return
+        sha = self._redis_script_shas.get(script)
+        if sha is None:
+            sha = yield self.redis.script_load(script)
+            self._redis_script_shas[script] = sha
+        try:
+            result = yield self.redis.evalsha(sha, keys, args)
+        except self.redis.RESPONSE_ERROR, e:
+            if 'NOSCRIPT' not in str(e):
+                raise
+            result = yield self.redis.eval(script, keys, args)
+        returnValue(result)
+
+    # Compact the receive buffer once this much consumed data has
+    # accumulated at the front of it.
+    COMPACT_DATASTREAM_AT = 65536
 
-        if (yield self.redis.get('smpp_last_sequence_number')) < 0xFFFF0000:
-            # Our stored sequence number is no longer outside the allowed
-            # range, so someone else must have reset it before we got the lock.
-            return
+    def dataReceived(self, data):
+        """Frame the receive buffer into PDUs and process each one.
 
-        # We reset the counter by deleting the key. The next INCR will recreate
-        # it for us.
-        yield self.redis.delete('smpp_last_sequence_number')
+        The buffer is a bytearray with a read cursor, so appending received
+        data is amortised O(1) and popping a PDU is a cursor bump plus a
+        single copy of just that PDU, rather than recopying the whole
+        buffer for every PDU the way string slicing did. Consumed bytes are
+        trimmed off the front in large batches.
 
-    def pop_data(self):
-        data = None
-        if(len(self.datastream) >= 16):
-            command_length = int(binascii.b2a_hex(self.datastream[0:4]), 16)
-            if(len(self.datastream) >= command_length):
-                data = self.datastream[0:command_length]
-                self.datastream = self.datastream[command_length:]
-        return data
+        A single TCP chunk often carries many small PDUs, so the framing
+        loop works on local variable bindings; attribute lookups inside
+        the loop would roughly double its interpreter cost.
+        """
+        buf = self.datastream
+        buf.extend(data)
+        pos = self._read_pos
+        n = len(buf)
+        view = memoryview(buf)
+        process_pdu = self._process_pdu
+        while n - pos >= 16:
+            command_length = unpack_from('>I', buf, pos)[0]
+            if n - pos < command_length:
+                break
+            process_pdu(view[pos:pos + command_length].tobytes())
+            pos += command_length
+        del view
+        if pos >= self.COMPACT_DATASTREAM_AT:
+            del buf[:pos]
+            pos = 0
+        self._read_pos = pos
 
     @inlineCallbacks
     def handle_data(self, data):
         pdu = unpack_pdu(data)
         command_id = pdu['header']['command_id']
         if command_id not in ('enquire_link', 'enquire_link_resp'):
-            log.debug('INCOMING <<<< %s' % binascii.b2a_hex(data))
-            log.debug('INCOMING <<<< %s' % pdu)
-        handler = getattr(self, 'handle_%s' % (command_id,),
-                          self._command_handler_not_found)
-        yield handler(pdu)
+            # Hex-encoding the PDU and formatting the unpacked dict are
+            # only worth doing if an observer renders the debug event.
+            log.debug('INCOMING <<<<', LazyFormat(binascii.b2a_hex, data))
+            log.debug('INCOMING <<<<', LazyFormat(str, pdu))
+        handler = self._HANDLERS.get(command_id)
+        if handler is None:
+            self._command_handler_not_found(pdu)
+        else:
+            yield handler(self, pdu)
 
-    @inlineCallbacks
-    def _process_pdu_queue(self):
-        data = yield self._pdu_queue.get()
-        while data is not None:
-            yield self.handle_data(data)
-            data = yield self._pdu_queue.get()
+    def _process_pdu(self, data):
+        d = self._process_pdu_d.addCallback(
+            lambda _, data=data: self.handle_data(data))
+        # Log failures, but don't let them block later PDUs.
+        self._process_pdu_d = d.addErrback(log.err)
+        return d
 
     def _command_handler_not_found(self, pdu):
         log.err('No command handler available for %s' % (pdu,))
@@ -159,7 +257,7 @@ class EsmeTransceiver(Protocol):
     @inlineCallbacks
     def connectionMade(self):
         self.state = 'OPEN'
-        log.msg('STATE: %s' % (self.state))
+        log.msg('STATE:', self.state)
         seq = yield self.get_next_seq()
         pdu = self.BIND_PDU(seq, **self.bind_params)
         log.msg(pdu.get_obj())
@@ -185,38 +283,64 @@ class EsmeTransceiver(Protocol):
         self.state = 'CLOSED'
         self.stop_enquire_link()
         self.cancel_drop_connection_call()
-        log.msg('STATE: %s' % (self.state))
+        log.msg('STATE:', self.state)
         self.esme_callbacks.disconnect()
 
-    def dataReceived(self, data):
-        self.datastream += data
-        data = self.pop_data()
-        while data is not None:
-            self._pdu_queue.put(data)
-            data = self.pop_data()
-
     def send_pdu(self, pdu):
         data = pdu.get_bin()
-        unpacked = unpack_pdu(data)
-        command_id = unpacked['header']['command_id']
+        # The PDU object already knows its command_id; re-parsing the
+        # binary we just packed would cost a full PDU decode per outbound
+        # frame.
+        obj = pdu.get_obj()
+        command_id = obj['header']['command_id']
         if command_id not in ('enquire_link', 'enquire_link_resp'):
-            log.debug('OUTGOING >>>> %s' % unpacked)
+            log.debug('OUTGOING >>>>', LazyFormat(str, obj))
         self.transport.write(data)
 
+    def send_pdus(self, pdus):
+        """Write a batch of PDUs to the transport in one call.
+
+        writeSequence() hands the whole batch to the transport at once,
+        which on POSIX coalesces into a single writev() syscall instead
+        of one write() per PDU.
+        """
+        for pdu in pdus:
+            log.debug('OUTGOING >>>>', LazyFormat(str, pdu.get_obj()))
+        self.transport.writeSequence([pdu.get_bin() for pdu in pdus])
+
     @inlineCallbacks
     def start_enquire_link(self):
-        self.lc_enquire = LoopingCall(self.enquire_link)
-        self.lc_enquire.start(self.smpp_enquire_link_interval)
+        self._enquire_link_running = True
+        self._enquire_link_tick()
         self.cancel_drop_connection_call()
         yield self.esme_callbacks.connect(self)
 
+    # Rather than a LoopingCall's fixed schedule, each enquire_link
+    # schedules the next one only once it has completed. A slow redis or
+    # SMSC can therefore never stack up pending enquires.
+
+    def _enquire_link_tick(self):
+        self._enquire_link_call = None
+        d = self.enquire_link()
+        d.addErrback(log.err)
+        d.addCallback(lambda _: self._schedule_enquire_link())
+        self._enquire_link_d = d
+
+    def _schedule_enquire_link(self):
+        if self._enquire_link_running:
+            self._enquire_link_call = self.callLater(
+                self.smpp_enquire_link_interval, self._enquire_link_tick)
+
     @inlineCallbacks
     def stop_enquire_link(self):
-        lc_enquire = getattr(self, 'lc_enquire', None)
-        if lc_enquire and lc_enquire.running:
-            lc_enquire.stop()
-            log.msg('Stopped enquire link looping call')
-            yield lc_enquire.deferred
+        if self._enquire_link_running:
+            self._enquire_link_running = False
+            if self._enquire_link_call is not None:
+                self._enquire_link_call.cancel()
+                self._enquire_link_call = None
+            log.msg('Stopped sending enquire links')
+            # Wait for any in-flight enquire_link to finish.
+            yield self._enquire_link_d
 
     def cancel_drop_connection_call(self):
         if self._lose_conn is not None:
@@ -234,11 +358,11 @@ class EsmeTransceiver(Protocol):
         if pdu['header']['command_status'] == 'ESME_ROK':
             self.state = 'BOUND_TRX'
             yield self.start_enquire_link()
-        log.msg('STATE: %s' % (self.state))
+        log.msg('STATE:', self.state)
 
     @inlineCallbacks
     def handle_submit_sm_resp(self, pdu):
-        yield self.pop_unacked()
+        self.pop_unacked()
         message_id = pdu.get('body', {}).get(
                 'mandatory_parameters', {}).get('message_id')
         yield self.esme_callbacks.submit_sm_resp(
@@ -294,7 +418,7 @@ class EsmeTransceiver(Protocol):
 
     @inlineCallbacks
     def handle_deliver_sm(self, pdu):
-        if self.state not in ['BOUND_RX', 'BOUND_TRX']:
+        if self.state not in RECV_STATES:
             log.err('WARNING: Received deliver_sm in wrong state: %s' % (
                 self.state))
             return
@@ -417,7 +541,7 @@ class EsmeTransceiver(Protocol):
     def load_multipart_message(self, redis_key):
         value = yield self.redis.get(redis_key)
         value = json.loads(value) if value else {}
-        log.debug("Retrieved value: %s" % (repr(value)))
+        log.debug("Retrieved value:", LazyFormat(repr, value))
         returnValue(MultipartMessage(self._unhex_from_redis(value)))
 
     def save_multipart_message(self, redis_key, multipart_message):
@@ -437,13 +561,13 @@ class EsmeTransceiver(Protocol):
     @inlineCallbacks
     def _handle_deliver_sm_multipart(self, pdu, pdu_params):
         redis_key = "multi_%s" % (multipart_key(detect_multipart(pdu)),)
-        log.debug("Redis multipart key: %s" % (redis_key))
+        log.debug("Redis multipart key:", redis_key)
         multi = yield self.load_multipart_message(redis_key)
         multi.add_pdu(pdu)
         completed = multi.get_completed()
         if completed:
             yield self.redis.delete(redis_key)
-            log.msg("Reassembled Message: %s" % (completed['message']))
+            log.msg("Reassembled Message:", completed['message'])
             # We assume that all parts have the same data_coding here, because
             # otherwise there's nothing sensible we can do.
             decoded_msg = self._decode_message(completed['message'],
@@ -459,9 +583,8 @@ class EsmeTransceiver(Protocol):
     def handle_enquire_link(self, pdu):
         if pdu['header']['command_status'] == 'ESME_ROK':
             log.msg("enquire_link OK")
-            sequence_number = pdu['header']['sequence_number']
-            pdu_resp = EnquireLinkResp(sequence_number)
-            self.send_pdu(pdu_resp)
+            self.transport.write(patch_sequence_number(
+                ENQUIRE_LINK_RESP_BIN, pdu['header']['sequence_number']))
         else:
             log.msg("enquire_link NOT OK: %r" % (pdu,))
 
@@ -474,25 +597,28 @@ class EsmeTransceiver(Protocol):
     def get_unacked_count(self):
         return self.redis.llen("unacked").addCallback(int)
 
-    @inlineCallbacks
-    def push_unacked(self, sequence_number=-1):
-        yield self.redis.lpush("unacked", sequence_number)
-        log.msg("unacked pushed to: %s" % ((yield self.get_unacked_count())))
+    # The unacked list is only bookkeeping (nothing reads it back for
+    # correctness), so we don't hold up PDU processing waiting for the
+    # round-trip to redis.
+
+    def push_unacked(self, *sequence_numbers):
+        d = self.redis.lpush("unacked", *sequence_numbers)
+        d.addErrback(log.err)
 
-    @inlineCallbacks
     def pop_unacked(self):
-        yield self.redis.lpop("unacked")
-        log.msg("unacked popped to: %s" % ((yield self.get_unacked_count())))
+        d = self.redis.lpop("unacked")
+        d.addErrback(log.err)
 
     @inlineCallbacks
     def submit_sm(self, **kwargs):
-        if self.state not in ['BOUND_TX', 'BOUND_TRX']:
+        if self.state not in SEND_STATES:
             log.err(('WARNING: submit_sm in wrong state: %s, '
                      'dropping message: %s' % (self.state, kwargs)))
             returnValue(0)
 
-        pdu_params = self.bind_params.copy()
-        pdu_params.update(kwargs)
+        # dict(a, **b) merges in one C-level call rather than a copy
+        # followed by an update.
+        pdu_params = dict(self.bind_params, **kwargs)
         message = pdu_params['short_message']
 
         # We use GSM_MAX_SMS_BYTES here because we may have already-encoded
@@ -519,8 +645,32 @@ class EsmeTransceiver(Protocol):
         returnValue([sequence_number])
 
     @inlineCallbacks
-    def _submit_sm(self, **pdu_params):
-        sequence_number = yield self.get_next_seq()
+    def submit_sm_batch(self, messages):
+        """Submit several short messages under a single deferred.
+
+        :param list messages:
+            A list of submit_sm keyword-parameter dicts, one per message.
+
+        Sequence numbers are allocated for the whole batch at once, the
+        PDUs are written to the transport in a single call and the
+        unacked list is updated with a single push, so the cost of the
+        deferred plumbing is paid once per batch instead of once per
+        message. Messages needing multipart splitting belong in
+        :meth:`submit_sm` instead.
+        """
+        if self.state not in SEND_STATES:
+            log.err(('WARNING: submit_sm_batch in wrong state: %s, '
+                     'dropping messages: %s' % (self.state, messages)))
+            returnValue([])
+
+        sequence_numbers = yield self.get_next_seq_range(len(messages))
+        self.send_pdus([
+            self._build_submit_sm_pdu(seq, **dict(self.bind_params, **kwargs))
+            for seq, kwargs in zip(sequence_numbers, messages)])
+        self.push_unacked(*sequence_numbers)
+        returnValue(sequence_numbers)
+
+    def _build_submit_sm_pdu(self, sequence_number, **pdu_params):
         message = pdu_params['short_message']
         sar_params = pdu_params.pop('sar_params', None)
         message_type = pdu_params.pop('message_type', 'sms')
@@ -532,21 +682,38 @@ class EsmeTransceiver(Protocol):
             update_ussd_pdu(pdu, continue_session, session_info)
 
         if self.config.send_long_messages and len(message) > 254:
-            pdu.add_message_payload(''.join('%02x' % ord(c) for c in message))
+            # binascii.hexlify() does the whole encode in one C call rather
+            # than formatting each byte in the interpreter.
+            pdu.add_message_payload(binascii.hexlify(message))
 
         if sar_params:
             pdu.set_sar_msg_ref_num(sar_params['msg_ref_num'])
             pdu.set_sar_total_segments(sar_params['total_segments'])
             pdu.set_sar_segment_seqnum(sar_params['segment_seqnum'])
 
+        return pdu
+
+    @inlineCallbacks
+    def _submit_sm(self, **pdu_params):
+        sequence_number = yield self.get_next_seq()
+        pdu = self._build_submit_sm_pdu(sequence_number, **pdu_params)
         self.send_pdu(pdu)
-        yield self.push_unacked(sequence_number)
+        self.push_unacked(sequence_number)
         returnValue(sequence_number)
 
+    def get_next_multipart_ref(self):
+        """Get a reference number for the parts of a multipart message.
+
+        A rolling counter over 1-255. The reference only has to be
+        unique among the messages currently in flight to this recipient,
+        so there's no need to pay for randint() on every multipart send.
+        """
+        self._multipart_ref = (self._multipart_ref % 255) + 1
+        return self._multipart_ref
+
     @inlineCallbacks
     def _submit_multipart_sar(self, **pdu_params):
         message = pdu_params['short_message']
-        split_msg = []
         # We chop the message into 130 byte chunks to leave 10 bytes for the
         # user data header the SMSC is presumably going to add for us. This is
         # a guess based mostly on optimism and the hope that we'll never have
@@ -554,67 +721,66 @@ class EsmeTransceiver(Protocol):
         # FIXME: If we have utf-8 encoded data, we might break in the
         # middle of a multibyte character.
         payload_length = GSM_MAX_SMS_BYTES - 10
-        while message:
-            split_msg.append(message[:payload_length])
-            message = message[payload_length:]
-        ref_num = randint(1, 255)
-        sequence_numbers = []
+        split_msg = [message[i:i + payload_length]
+                     for i in range(0, len(message), payload_length)]
+        ref_num = self.get_next_multipart_ref()
+        sequence_numbers = yield self.get_next_seq_range(len(split_msg))
         for i, msg in enumerate(split_msg):
-            params = pdu_params.copy()
-            params['short_message'] = msg
-            params['sar_params'] = {
+            params = dict(pdu_params, short_message=msg, sar_params={
                 'msg_ref_num': ref_num,
                 'total_segments': len(split_msg),
                 'segment_seqnum': i + 1,
-            }
-            sequence_number = yield self._submit_sm(**params)
-            sequence_numbers.append(sequence_number)
+            })
+            self.send_pdu(
+                self._build_submit_sm_pdu(sequence_numbers[i], **params))
+        self.push_unacked(*sequence_numbers)
         returnValue(sequence_numbers)
 
     @inlineCallbacks
     def _submit_multipart_udh(self, **pdu_params):
         message = pdu_params['short_message']
-        split_msg = []
         # We chop the message into 130 byte chunks to leave 10 bytes for the
         # 6-byte user data header we add and a little extra space in case the
         # SMSC does unexpected things with our message.
         # FIXME: If we have utf-8 encoded data, we might break in the
         # middle of a multibyte character.
         payload_length = GSM_MAX_SMS_BYTES - 10
-        while message:
-            split_msg.append(message[:payload_length])
-            message = message[payload_length:]
-        ref_num = randint(1, 255)
-        sequence_numbers = []
+        split_msg = [message[i:i + payload_length]
+                     for i in range(0, len(message), payload_length)]
+        ref_num = self.get_next_multipart_ref()
+        # See http://en.wikipedia.org/wiki/User_Data_Header for an
+        # explanation of the magic numbers below. We should probably
+        # abstract this out into a class that makes it less magic and
+        # opaque. Only the segment number varies between parts, so the rest
+        # of the header is packed once up front.
+        udh_prefix = pack('>BBBBB', 5, 0, 3, ref_num, len(split_msg))
+        sequence_numbers = yield self.get_next_seq_range(len(split_msg))
         for i, msg in enumerate(split_msg):
-            params = pdu_params.copy()
             # 0x40 is the UDHI flag indicating that this payload contains a
             # user data header.
-            params['esm_class'] = 0x40
-            # See http://en.wikipedia.org/wiki/User_Data_Header for an
-            # explanation of the magic numbers below. We should probably
-            # abstract this out into a class that makes it less magic and
-            # opaque.
-            udh = '\05\00\03%s%s%s' % (
-                chr(ref_num), chr(len(split_msg)), chr(i + 1))
-            params['short_message'] = udh + msg
-            sequence_number = yield self._submit_sm(**params)
-            sequence_numbers.append(sequence_number)
+            params = dict(pdu_params, esm_class=0x40,
+                          short_message=udh_prefix + chr(i + 1) + msg)
+            self.send_pdu(
+                self._build_submit_sm_pdu(sequence_numbers[i], **params))
+        self.push_unacked(*sequence_numbers)
         returnValue(sequence_numbers)
 
     @inlineCallbacks
     def enquire_link(self, **kwargs):
-        if self.state in ['BOUND_TX', 'BOUND_RX', 'BOUND_TRX']:
+        if self.state in BOUND_STATES:
             sequence_number = yield self.get_next_seq()
-            pdu = EnquireLink(
-                sequence_number, **dict(self.bind_params, **kwargs))
-            self.send_pdu(pdu)
+            if kwargs:
+                self.send_pdu(EnquireLink(
+                    sequence_number, **dict(self.bind_params, **kwargs)))
+            else:
+                self.transport.write(patch_sequence_number(
+                    ENQUIRE_LINK_BIN, sequence_number))
             returnValue(sequence_number)
         returnValue(0)
 
     @inlineCallbacks
     def query_sm(self, message_id, source_addr, **kwargs):
-        if self.state in ['BOUND_TX', 'BOUND_TRX']:
+        if self.state in SEND_STATES:
             sequence_number = yield self.get_next_seq()
             pdu = QuerySM(sequence_number,
                     message_id=message_id,
@@ -634,7 +800,7 @@ class EsmeTransmitter(EsmeTransceiver):
         if pdu['header']['command_status'] == 'ESME_ROK':
             self.state = 'BOUND_TX'
             yield self.start_enquire_link()
-        log.msg('STATE: %s' % (self.state))
+        log.msg('STATE:', self.state)
 
 
 class EsmeReceiver(EsmeTransceiver):
@@ -646,7 +812,7 @@ class EsmeReceiver(EsmeTransceiver):
         if pdu['header']['command_status'] == 'ESME_ROK':
             self.state = 'BOUND_RX'
             yield self.start_enquire_link()
-        log.msg('STATE: %s' % (self.state))
+        log.msg('STATE:', self.state)
 
 
 class EsmeTransceiverFactory(ClientFactory):
@@ -15,6 +15,13 @@ class FakeTransport(object):
     def __init__(self, protocol):
         self.connected = True
         self.protocol = protocol
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+    def writeSequence(self, data):
+        self.written.extend(data)
 
     def loseConnection(self):
         self.connected = False
@@ -31,6 +38,9 @@ class FakeEsmeMixin(object):
     def fake_send_pdu(self, pdu):
         self.fake_sent_pdus.append(pdu)
 
+    def fake_send_pdus(self, pdus):
+        self.fake_sent_pdus.extend(pdus)
+
 
 class FakeEsmeTransceiver(EsmeTransceiver, FakeEsmeMixin):
     def __init__(self, *args, **kwargs):
@@ -40,6 +50,9 @@ class FakeEsmeTransceiver(EsmeTransceiver, FakeEsmeMixin):
     def send_pdu(self, pdu):
         return self.fake_send_pdu(pdu)
 
+    def send_pdus(self, pdus):
+        return self.fake_send_pdus(pdus)
+
 
 class FakeEsmeReceiver(EsmeReceiver, FakeEsmeMixin):
     def __init__(self, *args, **kwargs):
@@ -49,6 +62,9 @@ class FakeEsmeReceiver(EsmeReceiver, FakeEsmeMixin):
     def send_pdu(self, pdu):
         return self.fake_send_pdu(pdu)
 
+    def send_pdus(self, pdus):
+        return self.fake_send_pdus(pdus)
+
 
 class FakeEsmeTransmitter(EsmeTransmitter, FakeEsmeMixin):
     def __init__(self, *args, **kwargs):
@@ -58,6 +74,9 @@ class FakeEsmeTransmitter(EsmeTransmitter, FakeEsmeMixin):
     def send_pdu(self, pdu):
         return self.fake_send_pdu(pdu)
 
+    def send_pdus(self, pdus):
+        return self.fake_send_pdus(pdus)
+
 
 class EsmeTestCaseBase(VumiTestCase):
     ESME_CLASS = None
@@ -169,8 +188,7 @@ class EsmeGenericMixin(object):
         self.assertEqual(['connect'], callbacks_called)
         self.assertEqual(True, esme.transport.connected)
         self.assertEqual(None, esme._lose_conn)
-        esme.lc_enquire.stop()
-        yield esme.lc_enquire.deferred
+        yield esme.stop_enquire_link()
 
     @inlineCallbacks
     def test_bind_and_disconnect(self):
@@ -185,21 +203,26 @@ class EsmeGenericMixin(object):
             BindTransceiverResp(1).get_bin()))
 
         self.assertEqual(['connect'], callbacks_called)
-        esme.lc_enquire.stop()
-        yield esme.lc_enquire.deferred
+        yield esme.stop_enquire_link()
 
         yield esme.transport.loseConnection()
 
         self.assertEqual(['connect', 'disconnect'], callbacks_called)
         self.assertEqual(False, esme.transport.connected)
 
+    def exhaust_seq_block(self, esme):
+        """Throw away the rest of the esme's local sequence number block."""
+        esme._seq_next = esme._seq_top
+
     @inlineCallbacks
     def test_sequence_rollover(self):
         esme = yield self.get_unbound_esme()
         self.assertEqual(1, (yield esme.get_next_seq()))
         self.assertEqual(2, (yield esme.get_next_seq()))
+        self.exhaust_seq_block(esme)
         yield esme.redis.set('smpp_last_sequence_number', 0xFFFF0000)
         self.assertEqual(0xFFFF0001, (yield esme.get_next_seq()))
+        self.exhaust_seq_block(esme)
         self.assertEqual(1, (yield esme.get_next_seq()))
 
     @inlineCallbacks
@@ -226,6 +249,24 @@ class EsmeTransmitterMixin(EsmeGenericMixin):
             'hello', sm['body']['mandatory_parameters']['short_message'])
         self.assertEqual([], sm['body'].get('optional_parameters', []))
 
+    @inlineCallbacks
+    def test_submit_sm_batch(self):
+        """Submit a batch of SMS messages in one call."""
+        esme = yield self.get_esme()
+        seq_nums = yield esme.submit_sm_batch([
+            {'short_message': 'hello'},
+            {'short_message': 'world'},
+        ])
+        self.assertEqual([2, 3], seq_nums)
+        short_messages = []
+        for seq_num, sm_pdu in zip(seq_nums, esme.fake_sent_pdus):
+            sm = unpack_pdu(sm_pdu.get_bin())
+            self.assertEqual('submit_sm', sm['header']['command_id'])
+            self.assertEqual(seq_num, sm['header']['sequence_number'])
+            short_messages.append(
+                sm['body']['mandatory_parameters']['short_message'])
+        self.assertEqual(['hello', 'world'], short_messages)
+
     @inlineCallbacks
     def test_submit_sm_sms_long(self):
         """Submit a USSD message with a session continue flag."""
@@ -17,6 +17,7 @@ from smpp.pdu_builder import (
 
 from vumi.transports.smpp.pdu_utils import (
     pdu_ok, seq_no, command_status, command_id, message_id, chop_pdu_stream)
+from vumi.transports.smpp.smpp_utils import classify_deliver_sm
 
 
 def require_bind(func):
@@ -358,17 +359,38 @@ class EsmeProtocol(Protocol):
             self.deliver_sm_processor.handle_multipart_pdu,
             self.deliver_sm_processor.handle_ussd_pdu,
         ]
-        for handler in pdu_handler_chain:
-            handled = yield handler(pdu)
-            if handled:
-                self.send_pdu(DeliverSMResp(seq_no(pdu),
-                              command_status='ESME_ROK'))
-                return
+        # Classify the PDU synchronously up front so that the common
+        # plain-SMS case skips straight to decoding and everything else
+        # is offered to its likeliest handler first. A processor may
+        # still decline a PDU the classifier picked it for (e.g. a
+        # DR-flagged multipart part with delivery_report_use_esm_class
+        # disabled), so a decline falls through the rest of the chain
+        # as before rather than skipping it.
+        kind = classify_deliver_sm(pdu)
+        preferred_handler = {
+            'dr': self.dr_processor.handle_delivery_report_pdu,
+            'multipart': self.deliver_sm_processor.handle_multipart_pdu,
+            'ussd': self.deliver_sm_processor.handle_ussd_pdu,
+        }.get(kind)
+        handled = False
+        if preferred_handler is not None:
+            handled = yield preferred_handler(pdu)
+            if not handled:
+                for handler in pdu_handler_chain:
+                    if handler is preferred_handler:
+                        continue
+                    handled = yield handler(pdu)
+                    if handled:
+                        break
+        if handled:
+            self.send_pdu(DeliverSMResp(seq_no(pdu),
+                          command_status='ESME_ROK'))
+            return
 
         # At this point we either have a DR in the message payload
         # or have a normal SMS that needs to be decoded and handled.
         content_parts = self.deliver_sm_processor.decode_pdus([pdu])
-        if not all([isinstance(part, unicode) for part in content_parts]):
+        if not all(isinstance(part, unicode) for part in content_parts):
             command_status = self.config.deliver_sm_decoding_error
             self.log.msg(
                 'Not all parts of the PDU were able to be decoded. '
@@ -1,3 +1,6 @@
+from smpp.pdu_inspector import detect_multipart
+
+
 def unpacked_pdu_opts(unpacked_pdu):
     pdu_opts = {}
     for opt in unpacked_pdu['body'].get('optional_parameters', []):
@@ -10,6 +13,37 @@ def detect_ussd(pdu_opts):
     return ('ussd_service_op' in pdu_opts)
 
 
+# If any of bits 5-2 of esm_class are set, assume a delivery report.
+DR_ESM_CLASS_MASK = 0b00111100
+
+
+def classify_deliver_sm(pdu):
+    """Cheaply classify a deliver_sm PDU without touching a deferred.
+
+    Returns one of ``'dr'``, ``'multipart'``, ``'ussd'`` or ``'sms'``,
+    mirroring the checks the PDU processors do themselves and in the
+    same order of precedence. This lets the common plain-SMS case skip
+    straight to decoding rather than being probed by each processor in
+    turn.
+
+    The classification is a hint, not a verdict: a processor may be
+    configured to ignore the signal the classifier keyed on (e.g.
+    ``delivery_report_use_esm_class`` is disabled), so callers must
+    still cope with the classified processor declining the PDU.
+    """
+    pdu_opts = unpacked_pdu_opts(pdu)
+    if 'receipted_message_id' in pdu_opts and 'message_state' in pdu_opts:
+        return 'dr'
+    mandatory_parameters = pdu['body']['mandatory_parameters']
+    if mandatory_parameters['esm_class'] & DR_ESM_CLASS_MASK:
+        return 'dr'
+    if detect_multipart(pdu):
+        return 'multipart'
+    if detect_ussd(pdu_opts):
+        return 'ussd'
+    return 'sms'
+
+
 def update_ussd_pdu(sm_pdu, continue_session, session_info=None):
     if session_info is None:
         session_info = '0000'
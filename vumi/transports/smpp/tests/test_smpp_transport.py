@@ -474,6 +474,36 @@ class SmppTransceiverTransportTestCase(SmppTransportTestCase):
         [msg] = yield self.tx_helper.wait_for_dispatched_inbound(1)
         self.assertEqual(msg['content'], u'back at you')
 
+    @inlineCallbacks
+    def test_mo_sms_multipart_udh_dr_esm_class_disabled(self):
+        """
+        If ``esm_class`` checking is disabled, a multipart part with a
+        delivery report bit set in its ``esm_class`` is still reassembled
+        rather than being treated as a DR or a plain SMS.
+        """
+        yield self.get_transport({
+            "delivery_report_processor_config": {
+                "delivery_report_use_esm_class": False,
+            }
+        })
+        deliver_sm_resps = []
+        self.fake_smsc.send_mo(
+            sequence_number=1, short_message="\x05\x00\x03\xff\x03\x01back",
+            esm_class=0x44)
+        deliver_sm_resps.append((yield self.fake_smsc.await_pdu()))
+        self.fake_smsc.send_mo(
+            sequence_number=2, short_message="\x05\x00\x03\xff\x03\x02 at",
+            esm_class=0x44)
+        deliver_sm_resps.append((yield self.fake_smsc.await_pdu()))
+        self.fake_smsc.send_mo(
+            sequence_number=3, short_message="\x05\x00\x03\xff\x03\x03 you",
+            esm_class=0x44)
+        deliver_sm_resps.append((yield self.fake_smsc.await_pdu()))
+        self.assertEqual([1, 2, 3], map(seq_no, deliver_sm_resps))
+        self.assertTrue(all(map(pdu_ok, deliver_sm_resps)))
+        [msg] = yield self.tx_helper.wait_for_dispatched_inbound(1)
+        self.assertEqual(msg['content'], u'back at you')
+
     @inlineCallbacks
     def test_mo_sms_multipart_udh_out_of_order(self):
         yield self.get_transport()